@@ -1,13 +1,21 @@
 import streamlit as st
 import pandas as pd
-import psycopg2
+import numpy as np
 from psycopg2 import sql
+from psycopg2.pool import ThreadedConnectionPool
+import connectorx as cx
+import matplotlib
+matplotlib.use('Agg')  # Backend sem interface gráfica: as figuras viram PNG
 import matplotlib.pyplot as plt
 from matplotlib_venn import venn2
 import plotly.express as px
 import plotly.graph_objects as go
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from threading import BoundedSemaphore
 from datetime import datetime, timedelta
 from io import BytesIO
+from urllib.parse import quote_plus
 
 # Configuração da página
 st.set_page_config(
@@ -16,36 +24,118 @@ st.set_page_config(
     layout="wide"
 )
 
+# Tamanho máximo do pool de conexões
+MAX_CONEXOES = 10
+
 # Função para conectar ao PostgreSQL
 @st.cache_resource
 def get_connection():
-    """Estabelece conexão com PostgreSQL"""
+    """Cria o pool de conexões com PostgreSQL"""
     try:
         # Usando st.secrets para credenciais
         db_config = st.secrets["postgres"]
         
-        conn = psycopg2.connect(
+        pool = ThreadedConnectionPool(
+            minconn=1,
+            maxconn=MAX_CONEXOES,
             host=db_config["host"],
             database=db_config["database"],
             user=db_config["user"],
             password=db_config["password"],
             port=db_config["port"]
         )
-        return conn
+        return pool
     except Exception as e:
         st.error(f"Erro ao conectar ao banco de dados: {e}")
         return None
 
+# Função para limitar o uso simultâneo do pool
+@st.cache_resource
+def get_semaforo():
+    """Semáforo com uma vaga por conexão do pool"""
+    return BoundedSemaphore(MAX_CONEXOES)
+
+# Função para usar uma conexão do pool
+@contextmanager
+def get_conn():
+    """Empresta uma conexão do pool e a devolve ao final do uso"""
+    pool = get_connection()
+    semaforo = get_semaforo()
+    
+    # Com o pool esgotado, espera uma conexão ser devolvida em vez de falhar com PoolError
+    semaforo.acquire()
+    try:
+        conn = pool.getconn()
+        try:
+            yield conn
+        finally:
+            # Encerra a transação aberta pela consulta; conexões derrubadas são descartadas
+            if not conn.closed:
+                conn.rollback()
+            pool.putconn(conn, close=bool(conn.closed))
+    finally:
+        semaforo.release()
+
+# Função para montar a URL de conexão do connectorx
+@st.cache_resource
+def get_dsn():
+    """Monta a URL de conexão a partir das credenciais em st.secrets"""
+    db_config = st.secrets["postgres"]
+    return (
+        f"postgresql://{quote_plus(db_config['user'])}:{quote_plus(db_config['password'])}"
+        f"@{db_config['host']}:{db_config['port']}/{db_config['database']}?sslmode=prefer"
+    )
+
+# Função para executar consultas via connectorx
+def ler_sql(query, params=None):
+    """Executa a consulta com connectorx e retorna DataFrame com colunas Arrow"""
+    # connectorx não aceita parâmetros: o psycopg2 faz a interpolação com escape.
+    # A conexão do pool só é usada para isso e volta antes da leitura, que o
+    # connectorx faz com conexão própria
+    with get_conn() as conn, conn.cursor() as cur:
+        query_final = cur.mogrify(query, params).decode()
+    
+    tabela = cx.read_sql(get_dsn(), query_final.strip().rstrip(';'), return_type='arrow')
+    return tabela.to_pandas(types_mapper=pd.ArrowDtype)
+
+# Colunas aceitas nos filtros dinâmicos e alias da tabela de origem
+COLUNAS_FILTRO = {
+    'cidade': 'c',
+    'vendedor': 'v',
+    'atividade': 'c',
+    'rede': 'c'
+}
+
+# Função para montar os filtros dinâmicos
+def montar_filtros(filtros):
+    """Monta as condições SQL e os parâmetros dos filtros selecionados"""
+    condicoes = []
+    params = []
+    for coluna, valores in filtros.items():
+        if valores:
+            condicoes.append(
+                sql.SQL("AND {} = ANY(%s)").format(sql.Identifier(COLUNAS_FILTRO[coluna], coluna))
+            )
+            params.append(list(valores))
+    return sql.SQL(' ').join(condicoes), params
+
 # Função para carregar dados
-@st.cache_data(ttl=600)  # Cache por 10 minutos
-def load_data(_conn, data_inicio, data_fim):
-    """Carrega dados de vendas do PostgreSQL"""
-    query = """
+# cache_resource devolve o mesmo DataFrame a cada rerun, sem a cópia que o
+# cache_data faz; por isso o resultado nunca deve ser modificado in-place
+@st.cache_resource(ttl=600)  # Cache por 10 minutos
+def load_data(data_inicio, data_fim, cidades=None, vendedores=None, atividades=None, redes=None):
+    """Carrega dados de vendas do PostgreSQL já com os filtros aplicados"""
+    condicoes, params_filtros = montar_filtros({
+        'cidade': cidades,
+        'vendedor': vendedores,
+        'atividade': atividades,
+        'rede': redes
+    })
+    query = sql.SQL("""
     SELECT 
         v.cliente,
         v.mercadoria,
         v.data_emissao,
-        v.valor_liq,
         v.quant,
         v.vendedor,
         c.cidade,
@@ -58,117 +148,246 @@ def load_data(_conn, data_inicio, data_fim):
         on v.cliente = c.cliente
     left join mercadorias m
         on v.mercadoria = m.mercadoria
-    WHERE data_emissao::date BETWEEN %s AND %s
-    ORDER BY data_emissao desc;
-    """
+    WHERE v.data_emissao >= %s::timestamp
+        AND v.data_emissao < (%s::date + INTERVAL '1 day')
+        {filtros};
+    """).format(filtros=condicoes)
+    params = [data_inicio, data_fim] + params_filtros
     
     try:
-        df = pd.read_sql_query(query, _conn, params=(data_inicio, data_fim))
+        df = ler_sql(query, params)
+        
+        # Cliente e produto como categorias: comparações, isin e groupby passam a usar códigos inteiros
+        df['cliente'] = df['cliente'].astype('category')
+        df['mercadoria'] = df['mercadoria'].astype('category')
+        
+        # quant vira inteiro quando não há fração, nunca abaixo de int32 para não estourar nas somas
+        quant = pd.to_numeric(df['quant'].astype('float64'), downcast='integer')
+        if pd.api.types.is_integer_dtype(quant):
+            quant = quant.astype(np.promote_types(quant.dtype, np.int32))
+        df['quant'] = quant
+        df['data_emissao'] = df['data_emissao'].astype('datetime64[ns]')
         return df
     except Exception as e:
         st.error(f"Erro ao carregar dados: {e}")
         return pd.DataFrame()
 
-# Função para obter lista de produtos
+# Listas de referência da sidebar: coluna e view materializada de origem
+LISTAS_REFERENCIA = {
+    'cidades': ('cidade', 'mv_cidades'),
+    'vendedores': ('vendedor', 'mv_vendedores'),
+    'atividades': ('atividade', 'mv_atividades'),
+    'redes': ('rede', 'mv_redes')
+}
+
+# Função para obter as listas de referência
+@st.cache_data(ttl=3600)
+def fetch_reference_lists():
+    """Busca em paralelo as listas de referência da sidebar"""
+    # Consultas sem parâmetros: as threads só executam o connectorx com a URL obtida aqui
+    dsn = get_dsn()
+    listas = {}
+    
+    with ThreadPoolExecutor(max_workers=len(LISTAS_REFERENCIA)) as executor:
+        futuros = {
+            executor.submit(
+                cx.read_sql, dsn, f"SELECT {coluna} FROM {view} ORDER BY {coluna}", return_type='arrow'
+            ): (nome, coluna)
+            for nome, (coluna, view) in LISTAS_REFERENCIA.items()
+        }
+        for futuro in as_completed(futuros):
+            nome, coluna = futuros[futuro]
+            try:
+                listas[nome] = futuro.result().column(coluna).to_pylist()
+            except Exception as e:
+                st.error(f"Erro ao carregar {nome}: {e}")
+                listas[nome] = []
+    
+    return listas
+
+# Função para obter os produtos vendidos no período
 @st.cache_data(ttl=600)
-def get_produtos(_conn):
-    """Retorna lista única de produtos"""
+def fetch_produtos_periodo(data_inicio, data_fim):
+    """Retorna os produtos vendidos no período, independente dos filtros adicionais"""
     query = """
-    SELECT 
-    DISTINCT v.mercadoria 
+    SELECT DISTINCT v.mercadoria
     FROM vendas v
-    inner join mercadorias m
-        on m.mercadoria  = v.mercadoria
-    WHERE m.custo_inf > 0.01 and m.divisao in (2,3,4,5,6,7,10,11,12,14,15,16)
-    ORDER BY mercadoria;
+    inner join clientes c
+        on v.cliente = c.cliente
+    WHERE v.data_emissao >= %s::timestamp
+        AND v.data_emissao < (%s::date + INTERVAL '1 day')
+    ORDER BY v.mercadoria;
     """
     try:
-        df = pd.read_sql_query(query, _conn)
+        df = ler_sql(query, [data_inicio, data_fim])
         return df['mercadoria'].tolist()
     except Exception as e:
         st.error(f"Erro ao carregar produtos: {e}")
         return []
 
-# Função para obter lista de cidades
+# Função para obter as flags de compra por cliente
 @st.cache_data(ttl=600)
-def get_cidades(_conn):
-    """Retorna lista única de cidades"""
-    query = """
-    SELECT DISTINCT c.cidade 
+def venn_counts(data_inicio, data_fim, produto_a, produto_b, filtros):
+    """Retorna, por cliente, se comprou o produto A e/ou o produto B"""
+    condicoes, params_filtros = montar_filtros(filtros)
+    query = sql.SQL("""
+    SELECT 
+        v.cliente,
+        bool_or(v.mercadoria = %s) as a,
+        bool_or(v.mercadoria = %s) as b
     FROM vendas v
     inner join clientes c
-        on v.cliente = c.cliente 
-    WHERE cidade IS NOT null and UF = 'MG'
-    ORDER BY cidade
-    """
-    try:
-        df = pd.read_sql_query(query, _conn)
-        return df['cidade'].tolist()
-    except Exception as e:
-        return []
-
-# Função para obter lista de vendedores
-@st.cache_data(ttl=600)
-def get_vendedores(_conn):
-    """Retorna lista única de vendedores"""
-    query = """
-    SELECT DISTINCT v.vendedor 
-    FROM vendas v
-    inner join vendedores ve
-        on ve.vendedor  = v.vendedor  
-    WHERE ve.data_desligamento IS NULL
-    ORDER BY v.vendedor 
-    """
+        on v.cliente = c.cliente
+    WHERE v.data_emissao >= %s::timestamp
+        AND v.data_emissao < (%s::date + INTERVAL '1 day')
+        AND v.mercadoria IN (%s, %s)
+        {filtros}
+    GROUP BY v.cliente;
+    """).format(filtros=condicoes)
+    params = [produto_a, produto_b, data_inicio, data_fim, produto_a, produto_b] + params_filtros
+    
     try:
-        df = pd.read_sql_query(query, _conn)
-        return df['vendedor'].tolist()
+        buffer = BytesIO()
+        with get_conn() as conn, conn.cursor() as cur:
+            # COPY não aceita parâmetros: a consulta é interpolada antes pelo psycopg2
+            consulta = cur.mogrify(query, params).decode().strip().rstrip(';')
+            cur.copy_expert(f"COPY ({consulta}) TO STDOUT WITH CSV HEADER", buffer)
+        buffer.seek(0)
+        
+        # Cliente lido como texto, exatamente como sai do banco
+        df = pd.read_csv(buffer, dtype={'cliente': str}, true_values=['t'], false_values=['f'])
+        return df
     except Exception as e:
-        return []
+        st.error(f"Erro ao calcular venda cruzada: {e}")
+        return pd.DataFrame(columns=['cliente', 'a', 'b'])
 
 # Função para análise de venda cruzada
-def analisar_venda_cruzada(df, produto_a, produto_b):
-    """Analisa venda cruzada entre dois produtos"""
-    
-    # Clientes que compraram produto A
-    clientes_a = set(df[df['mercadoria'] == produto_a]['cliente'].unique())
-    
-    # Clientes que compraram produto B
-    clientes_b = set(df[df['mercadoria'] == produto_b]['cliente'].unique())
-    
-    # Clientes exclusivos de A
-    apenas_a = clientes_a - clientes_b
+def analisar_venda_cruzada(flags):
+    """Analisa venda cruzada a partir das flags de compra por cliente"""
+    
+    # Flags de compra por cliente (uma linha por cliente)
+    comprou_a = flags['a'].astype(bool)
+    comprou_b = flags['b'].astype(bool)
+    
+    # Máscaras de cada região do diagrama
+    mask_apenas_a = comprou_a & ~comprou_b
+    mask_apenas_b = comprou_b & ~comprou_a
+    mask_ambos = comprou_a & comprou_b
+    
+    # Região de cada cliente, calculada uma única vez e reaproveitada pelas tabelas
+    categoria = pd.Series(
+        np.select([mask_ambos, mask_apenas_a, mask_apenas_b], ['ambos', 'apenas_a', 'apenas_b'], default=''),
+        index=flags['cliente']
+    )
     
-    # Clientes exclusivos de B
-    apenas_b = clientes_b - clientes_a
+    return {
+        'clientes_a': flags.loc[comprou_a, 'cliente'],
+        'clientes_b': flags.loc[comprou_b, 'cliente'],
+        'apenas_a': flags.loc[mask_apenas_a, 'cliente'],
+        'apenas_b': flags.loc[mask_apenas_b, 'cliente'],
+        'ambos': flags.loc[mask_ambos, 'cliente'],
+        'categoria': categoria,
+        'total_a': int(comprou_a.sum()),
+        'total_b': int(comprou_b.sum()),
+        'count_apenas_a': int(mask_apenas_a.sum()),
+        'count_apenas_b': int(mask_apenas_b.sum()),
+        'count_ambos': int(mask_ambos.sum())
+    }
+
+# Nomes das colunas exibidas nas tabelas de detalhamento
+COLUNAS_DETALHE = {
+    'cliente': 'Cliente',
+    'raz_social': 'Razão Social',
+    'cidade': 'Cidade',
+    'atividade': 'Atividade',
+    'rede': 'Rede',
+    'vendedor': 'Último Vendedor',
+    'produto': 'Produto',
+    'ultima_compra': 'Última Compra',
+    'qtd': 'Qtd Total',
+    'produtos': 'Produtos'
+}
+
+# Função para montar as tabelas de detalhamento
+def detalhar_clientes(df, resultado, produto_a, produto_b):
+    """Monta as tabelas de detalhamento com uma única agregação por cliente e produto"""
+    
+    # Apenas as vendas dos dois produtos analisados, em ordem cronológica
+    # para que 'last' traga o vendedor da venda mais recente
+    df_ab = df[df['mercadoria'].isin([produto_a, produto_b])].sort_values('data_emissao')
+    
+    agg = df_ab.groupby(['cliente', 'mercadoria'], observed=True).agg(
+        raz_social=('raz_social', 'first'),
+        cidade=('cidade', 'first'),
+        atividade=('atividade', 'first'),
+        rede=('rede', 'first'),
+        vendedor=('vendedor', 'last'),
+        produto=('descricao_produto', 'first'),
+        ultima_compra=('data_emissao', 'max'),
+        qtd=('quant', 'sum')
+    )
+    # A soma de A + B dos clientes de ambos é feita em 64 bits
+    if pd.api.types.is_integer_dtype(agg['qtd']):
+        agg['qtd'] = agg['qtd'].astype('int64')
+    
+    # Separar as linhas de cada produto (índice passa a ser só o cliente)
+    mercadorias = agg.index.get_level_values('mercadoria')
+    agg_a = agg[mercadorias == produto_a].droplevel('mercadoria')
+    agg_b = agg[mercadorias == produto_b].droplevel('mercadoria')
+    
+    # Região de cada cliente indexada pelo código inteiro da categoria
+    # (comparação pelo texto do cliente, forma em que venn_counts o recebe)
+    regiao_por_codigo = resultado['categoria'].reindex(df['cliente'].cat.categories.astype(str)).to_numpy()
+    regiao_a = regiao_por_codigo[agg_a.index.codes]
+    regiao_b = regiao_por_codigo[agg_b.index.codes]
+    
+    apenas_a = agg_a[regiao_a == 'apenas_a']
+    apenas_b = agg_b[regiao_b == 'apenas_b']
+    
+    # Clientes de ambos: combinar as linhas de A e B de cada cliente. As flags
+    # (venn_counts) e o frame (load_data) vêm de caches separados e podem divergir
+    # por alguns minutos; só entram os clientes com linhas dos dois produtos no frame
+    ambos_a = agg_a[regiao_a == 'ambos']
+    ambos_b = agg_b[regiao_b == 'ambos']
+    _, pos_a, pos_b = np.intersect1d(
+        ambos_a.index.codes, ambos_b.index.codes, assume_unique=True, return_indices=True
+    )
+    ambos_a = ambos_a.iloc[pos_a]
+    ambos_b = ambos_b.iloc[pos_b]
+    b_mais_recente = ambos_b['ultima_compra'] > ambos_a['ultima_compra']
+    ambos = ambos_a[['raz_social', 'cidade', 'atividade', 'rede']].assign(
+        vendedor=ambos_a['vendedor'].mask(b_mais_recente, ambos_b['vendedor']),
+        ultima_compra=ambos_a['ultima_compra'].mask(b_mais_recente, ambos_b['ultima_compra']),
+        qtd=ambos_a['qtd'] + ambos_b['qtd'],
+        produtos=ambos_a['produto'] + ' | ' + ambos_b['produto']
+    )
     
-    # Clientes que compraram ambos
-    ambos = clientes_a & clientes_b
+    def formatar(tabela):
+        return (
+            tabela.reset_index()
+            .rename(columns=COLUNAS_DETALHE)
+            .sort_values('Última Compra', ascending=False)
+        )
     
     return {
-        'clientes_a': clientes_a,
-        'clientes_b': clientes_b,
-        'apenas_a': apenas_a,
-        'apenas_b': apenas_b,
-        'ambos': ambos,
-        'total_a': len(clientes_a),
-        'total_b': len(clientes_b),
-        'count_apenas_a': len(apenas_a),
-        'count_apenas_b': len(apenas_b),
-        'count_ambos': len(ambos)
+        'apenas_a': formatar(apenas_a),
+        'apenas_b': formatar(apenas_b),
+        'ambos': formatar(ambos)
     }
 
 # Função para criar diagrama de Venn
-def criar_diagrama_venn(resultado, produto_a, produto_b):
-    """Cria diagrama de Venn com matplotlib"""
+@st.cache_data  # Mesmas contagens e produtos reaproveitam a imagem pronta
+def criar_diagrama_venn(count_apenas_a, count_apenas_b, count_ambos, total_a, total_b, produto_a, produto_b):
+    """Cria diagrama de Venn com matplotlib e retorna a imagem PNG"""
     
     fig, ax = plt.subplots(figsize=(12, 8))
     
     # Criar diagrama
     venn = venn2(
         subsets=(
-            resultado['count_apenas_a'],
-            resultado['count_apenas_b'],
-            resultado['count_ambos']
+            count_apenas_a,
+            count_apenas_b,
+            count_ambos
         ),
         set_labels=(produto_a, produto_b),
         ax=ax
@@ -209,19 +428,19 @@ def criar_diagrama_venn(resultado, produto_a, produto_b):
     plt.title('Análise de Venda Cruzada', fontsize=18, fontweight='bold', pad=20)
     
     # Calcular taxa de conversão
-    taxa_conversao = (resultado['count_ambos'] / resultado['total_a'] * 100) if resultado['total_a'] > 0 else 0
+    taxa_conversao = (count_ambos / total_a * 100) if total_a > 0 else 0
     
     # Box com estatísticas
-    total_geral = resultado['count_apenas_a'] + resultado['count_apenas_b'] + resultado['count_ambos']
+    total_geral = count_apenas_a + count_apenas_b + count_ambos
     
     stats_text = f'''Estatísticas:
 ──────────────────────
 Total Clientes: {total_geral}
-Total Produto A: {resultado['total_a']}
-Total Produto B: {resultado['total_b']}
-Apenas A: {resultado['count_apenas_a']}
-Apenas B: {resultado['count_apenas_b']}
-Ambos: {resultado['count_ambos']}
+Total Produto A: {total_a}
+Total Produto B: {total_b}
+Apenas A: {count_apenas_a}
+Apenas B: {count_apenas_b}
+Ambos: {count_ambos}
 Taxa Conversão: {taxa_conversao:.1f}%
 ──────────────────────'''
     
@@ -237,18 +456,19 @@ Taxa Conversão: {taxa_conversao:.1f}%
                        linewidth=2))
     
     plt.tight_layout()
-    return fig
+    
+    buffer = BytesIO()
+    fig.savefig(buffer, format='png', dpi=110)
+    plt.close(fig)
+    return buffer.getvalue()
 
 # Função para criar gráfico de barras
-def criar_grafico_barras(resultado):
+@st.cache_data  # Mesmas contagens reaproveitam a figura pronta
+def criar_grafico_barras(count_apenas_a, count_ambos, count_apenas_b):
     """Cria gráfico de barras com Plotly"""
     
     categorias = ['Apenas Produto A', 'Ambos', 'Apenas Produto B']
-    valores = [
-        resultado['count_apenas_a'],
-        resultado['count_ambos'],
-        resultado['count_apenas_b']
-    ]
+    valores = [count_apenas_a, count_ambos, count_apenas_b]
     cores = ['#4285F4', '#9C27B0', '#EA4335']
     
     fig = go.Figure(data=[
@@ -272,15 +492,135 @@ def criar_grafico_barras(resultado):
     
     return fig
 
+# Função para gerar o arquivo Excel
+def gerar_excel(df, sheet_name):
+    """Gera o conteúdo .xlsx de um DataFrame"""
+    buffer = BytesIO()
+    with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
+        df.to_excel(writer, index=False, sheet_name=sheet_name)
+    return buffer.getvalue()
+
+# Função para o botão de download Excel
+@st.fragment
+def botao_download_excel(df, sheet_name, prefixo_arquivo):
+    """Gera o Excel apenas quando solicitado, rerodando só este trecho"""
+    if st.button("📄 Gerar Excel", key=f'gerar_{prefixo_arquivo}'):
+        st.download_button(
+            label="📥 Download Excel",
+            data=gerar_excel(df, sheet_name),
+            file_name=f'{prefixo_arquivo}_{datetime.now().strftime("%Y%m%d")}.xlsx',
+            mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            key=f'download_{prefixo_arquivo}'
+        )
+
+# Linhas exibidas por vez nas tabelas de detalhamento
+LINHAS_POR_PAGINA = 200
+
+# Função para exibir tabela paginada
+def exibir_tabela_paginada(df, chave, selecao):
+    """Exibe só as primeiras linhas da tabela, com botão para carregar mais"""
+    # Guarda a seleção junto com o número de linhas: nova seleção volta à primeira página
+    chave_linhas = f'linhas_{chave}'
+    selecao_salva, linhas = st.session_state.get(chave_linhas, (None, LINHAS_POR_PAGINA))
+    if selecao_salva != selecao:
+        linhas = LINHAS_POR_PAGINA
+        st.session_state[chave_linhas] = (selecao, linhas)
+    
+    st.dataframe(df.head(linhas), use_container_width=True)
+    
+    if linhas < len(df):
+        st.caption(f"Exibindo {linhas:,} de {len(df):,} clientes")
+        st.button(
+            "⬇️ Carregar mais",
+            key=f'mais_{chave}',
+            on_click=lambda: st.session_state.update({chave_linhas: (selecao, linhas + LINHAS_POR_PAGINA)})
+        )
+
+# Aba do diagrama de Venn
+@st.fragment
+def aba_venn(resultado, produto_a, produto_b):
+    """Renderiza a aba do diagrama de Venn"""
+    st.subheader("Diagrama de Venn")
+    png_venn = criar_diagrama_venn(
+        resultado['count_apenas_a'],
+        resultado['count_apenas_b'],
+        resultado['count_ambos'],
+        resultado['total_a'],
+        resultado['total_b'],
+        produto_a,
+        produto_b
+    )
+    st.image(png_venn)
+
+# Aba do gráfico de barras
+@st.fragment
+def aba_barras(resultado):
+    """Renderiza a aba do gráfico de barras"""
+    st.subheader("Gráfico de Barras")
+    fig_barras = criar_grafico_barras(
+        resultado['count_apenas_a'],
+        resultado['count_ambos'],
+        resultado['count_apenas_b']
+    )
+    st.plotly_chart(fig_barras, use_container_width=True)
+
+# Aba das tabelas detalhadas
+@st.fragment
+def aba_tabelas(df_filtrado, resultado, produto_a, produto_b, selecao):
+    """Renderiza a aba das tabelas detalhadas"""
+    st.subheader("Detalhamento de Clientes")
+    
+    tabelas = detalhar_clientes(df_filtrado, resultado, produto_a, produto_b)
+    
+    # Tabela: Compraram A e não B
+    st.markdown("### 🔵 Clientes que compraram apenas Produto A")
+    if len(resultado['apenas_a']) > 0:
+        df_apenas_a = tabelas['apenas_a']
+        
+        exibir_tabela_paginada(df_apenas_a, 'apenas_a', selecao)
+        
+        # Botão de download Excel
+        botao_download_excel(df_apenas_a, 'Apenas Produto A', 'clientes_apenas_A')
+    else:
+        st.info("Nenhum cliente encontrado nesta categoria.")
+    
+    st.markdown("---")
+    
+    # Tabela: Compraram B e não A
+    st.markdown("### 🔴 Clientes que compraram apenas Produto B")
+    if len(resultado['apenas_b']) > 0:
+        df_apenas_b = tabelas['apenas_b']
+        
+        exibir_tabela_paginada(df_apenas_b, 'apenas_b', selecao)
+        
+        # Botão de download Excel
+        botao_download_excel(df_apenas_b, 'Apenas Produto B', 'clientes_apenas_B')
+    else:
+        st.info("Nenhum cliente encontrado nesta categoria.")
+    
+    st.markdown("---")
+    
+    # Tabela: Compraram Ambos
+    st.markdown("### 🟣 Clientes que compraram AMBOS os produtos")
+    if len(resultado['ambos']) > 0:
+        df_ambos = tabelas['ambos']
+        
+        exibir_tabela_paginada(df_ambos, 'ambos', selecao)
+        
+        # Botão de download Excel
+        botao_download_excel(df_ambos, 'Ambos Produtos', 'clientes_ambos')
+    else:
+        st.info("Nenhum cliente encontrado nesta categoria.")
+
 # Interface principal
 def main():
     st.title("📊 Análise de Venda Cruzada")
     st.markdown("---")
     
     # Conectar ao banco
-    conn = get_connection()
+    pool = get_connection()
     
-    if conn is None:
+    if pool is None:
         st.error("⚠️ Não foi possível conectar ao banco de dados. Verifique as configurações.")
         st.info("💡 Edite as credenciais do banco na função `get_connection()` no código.")
         return
@@ -311,38 +651,16 @@ def main():
             min_value=data_inicio
         )
     
-    # Carregar dados
-    with st.spinner("Carregando dados..."):
-        df = load_data(conn, data_inicio, data_fim)
-    
-    if df.empty:
-        st.warning("⚠️ Nenhum dado encontrado para o período selecionado.")
-        return
-    
-    st.sidebar.success(f"✅ {len(df)} registros carregados")
-    
-    # Filtro de produtos
-    st.sidebar.subheader("🛍️ Produtos")
-    
-    produtos_disponiveis = sorted(df['mercadoria'].unique())
-    
-    produto_a = st.sidebar.selectbox(
-        "Produto A (código Biz)",
-        options=produtos_disponiveis,
-        index=0 if len(produtos_disponiveis) > 0 else None
-    )
-    
-    produto_b = st.sidebar.selectbox(
-        "Produto B (código Biz)",
-        options=produtos_disponiveis,
-        index=1 if len(produtos_disponiveis) > 1 else 0
-    )
+    # Seção de produtos, preenchida após o carregamento dos dados
+    secao_produtos = st.sidebar.container()
     
     # Filtros adicionais
     st.sidebar.subheader("🎯 Filtros Adicionais")
     
+    listas = fetch_reference_lists()
+    
     # Filtro de cidade
-    cidades_disponiveis = ['Todas'] + sorted(df['cidade'].dropna().unique().tolist())
+    cidades_disponiveis = ['Todas'] + listas['cidades']
     cidade_selecionada = st.sidebar.multiselect(
         "Cidade",
         options=cidades_disponiveis,
@@ -350,7 +668,7 @@ def main():
     )
     
     # Filtro de vendedor
-    vendedores_disponiveis = ['Todos'] + sorted(df['vendedor'].dropna().unique().tolist())
+    vendedores_disponiveis = ['Todos'] + listas['vendedores']
     vendedor_selecionado = st.sidebar.multiselect(
         "Vendedor",
         options=vendedores_disponiveis,
@@ -358,7 +676,7 @@ def main():
     )
     
     # Filtro de atividade
-    atividades_disponiveis = ['Todas'] + sorted(df['atividade'].dropna().unique().tolist())
+    atividades_disponiveis = ['Todas'] + listas['atividades']
     atividade_selecionada = st.sidebar.multiselect(
         "Atividade",
         options=atividades_disponiveis,
@@ -366,27 +684,60 @@ def main():
     )
 
     # Filtro de rede
-    redes_disponiveis = ['Todas'] + sorted(df['rede'].dropna().unique().tolist())
+    redes_disponiveis = ['Todas'] + listas['redes']
     rede_selecionada = st.sidebar.multiselect(
         "Rede",
         options=redes_disponiveis,
         default=['Todas']
     )
     
-    # Aplicar filtros
-    df_filtrado = df.copy()
+    # Filtros selecionados (lista vazia significa sem filtro)
+    filtros = {
+        'cidade': [] if 'Todas' in cidade_selecionada else cidade_selecionada,
+        'vendedor': [] if 'Todos' in vendedor_selecionado else vendedor_selecionado,
+        'atividade': [] if 'Todas' in atividade_selecionada else atividade_selecionada,
+        'rede': [] if 'Todas' in rede_selecionada else rede_selecionada
+    }
     
-    if 'Todas' not in cidade_selecionada and len(cidade_selecionada) > 0:
-        df_filtrado = df_filtrado[df_filtrado['cidade'].isin(cidade_selecionada)]
+    # Carregar dados já filtrados no banco
+    with st.spinner("Carregando dados..."):
+        df = load_data(
+            data_inicio, data_fim,
+            cidades=tuple(filtros['cidade']),
+            vendedores=tuple(filtros['vendedor']),
+            atividades=tuple(filtros['atividade']),
+            redes=tuple(filtros['rede'])
+        )
     
-    if 'Todos' not in vendedor_selecionado and len(vendedor_selecionado) > 0:
-        df_filtrado = df_filtrado[df_filtrado['vendedor'].isin(vendedor_selecionado)]
-        
-    if 'Todas' not in atividade_selecionada and len(atividade_selecionada) > 0:
-        df_filtrado = df_filtrado[df_filtrado['atividade'].isin(atividade_selecionada)]
-
-    if 'Todas' not in rede_selecionada and len(rede_selecionada) > 0:
-        df_filtrado = df_filtrado[df_filtrado['rede'].isin(rede_selecionada)]
+    if df.empty:
+        st.warning("⚠️ Nenhum dado encontrado para o período e filtros selecionados.")
+        return
+    
+    secao_produtos.success(f"✅ {len(df)} registros carregados")
+    
+    # Filtro de produtos
+    secao_produtos.subheader("🛍️ Produtos")
+    
+    # Produtos do período inteiro: trocar os filtros adicionais não muda as opções
+    # nem, com as chaves fixas, a seleção feita
+    produtos_disponiveis = fetch_produtos_periodo(data_inicio, data_fim)
+    
+    produto_a = secao_produtos.selectbox(
+        "Produto A (código Biz)",
+        options=produtos_disponiveis,
+        index=0 if len(produtos_disponiveis) > 0 else None,
+        key='produto_a'
+    )
+    
+    produto_b = secao_produtos.selectbox(
+        "Produto B (código Biz)",
+        options=produtos_disponiveis,
+        index=1 if len(produtos_disponiveis) > 1 else 0,
+        key='produto_b'
+    )
+    
+    # Os filtros já foram aplicados na consulta (df é compartilhado pelo cache, somente leitura)
+    df_filtrado = df
     
     # Validação
     if produto_a == produto_b:
@@ -394,7 +745,8 @@ def main():
         return
     
     # Análise
-    resultado = analisar_venda_cruzada(df_filtrado, produto_a, produto_b)
+    flags = venn_counts(data_inicio, data_fim, produto_a, produto_b, filtros)
+    resultado = analisar_venda_cruzada(flags)
     
     # Métricas principais
     st.subheader("📈 Resumo")
@@ -432,155 +784,23 @@ def main():
     
     st.markdown("---")
     
+    # Seleção atual (período, produtos e filtros), usada para reiniciar a paginação
+    selecao = (
+        data_inicio, data_fim, produto_a, produto_b,
+        tuple((coluna, tuple(valores)) for coluna, valores in filtros.items())
+    )
+    
     # Visualizações
     tab1, tab2, tab3 = st.tabs(["📊 Diagrama de Venn", "📈 Gráfico de Barras", "📋 Tabelas Detalhadas"])
     
     with tab1:
-        st.subheader("Diagrama de Venn")
-        fig_venn = criar_diagrama_venn(resultado, produto_a, produto_b)
-        st.pyplot(fig_venn)
+        aba_venn(resultado, produto_a, produto_b)
     
     with tab2:
-        st.subheader("Gráfico de Barras")
-        fig_barras = criar_grafico_barras(resultado)
-        st.plotly_chart(fig_barras, use_container_width=True)
+        aba_barras(resultado)
     
     with tab3:
-        st.subheader("Detalhamento de Clientes")
-        
-        # Tabela: Compraram A e não B
-        st.markdown("### 🔵 Clientes que compraram apenas Produto A")
-        if len(resultado['apenas_a']) > 0:
-            df_apenas_a = df_filtrado[
-                df_filtrado['cliente'].isin(resultado['apenas_a']) &
-                (df_filtrado['mercadoria'] == produto_a)
-            ].groupby('cliente').agg({
-                'raz_social': 'first',
-                'cidade': 'first',
-                'atividade': 'first',
-                'rede': 'first',
-                'vendedor': 'last',
-                'descricao_produto': 'first',
-                'data_emissao': 'max',
-                'quant': 'sum'
-            }).reset_index()
-            
-            df_apenas_a.columns = ['Cliente', 'Razão Social', 'Cidade', 'Atividade', 'Rede', 'Último Vendedor', 'Produto', 'Última Compra', 'Qtd Total']
-            df_apenas_a = df_apenas_a.sort_values('Última Compra', ascending=False)
-            
-            st.dataframe(df_apenas_a, use_container_width=True)
-            
-            # Botão de download Excel
-            buffer = BytesIO()
-            with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-                df_apenas_a.to_excel(writer, index=False, sheet_name='Apenas Produto A')
-            buffer.seek(0)
-            
-            st.download_button(
-                label="📥 Download Excel",
-                data=buffer,
-                file_name=f'clientes_apenas_A_{datetime.now().strftime("%Y%m%d")}.xlsx',
-                mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            )
-        else:
-            st.info("Nenhum cliente encontrado nesta categoria.")
-        
-        st.markdown("---")
-        
-        # Tabela: Compraram B e não A
-        st.markdown("### 🔴 Clientes que compraram apenas Produto B")
-        if len(resultado['apenas_b']) > 0:
-            df_apenas_b = df_filtrado[
-                df_filtrado['cliente'].isin(resultado['apenas_b']) &
-                (df_filtrado['mercadoria'] == produto_b)
-            ].groupby('cliente').agg({
-                'raz_social': 'first',
-                'cidade': 'first',
-                'atividade': 'first',
-                'rede': 'first',
-                'vendedor': 'last',
-                'descricao_produto': 'first',
-                'data_emissao': 'max',
-                'quant': 'sum'
-            }).reset_index()
-            
-            df_apenas_b.columns = ['Cliente', 'Razão Social', 'Cidade', 'Atividade', 'Rede', 'Último Vendedor', 'Produto', 'Última Compra', 'Qtd Total']
-            df_apenas_b = df_apenas_b.sort_values('Última Compra', ascending=False)
-            
-            st.dataframe(df_apenas_b, use_container_width=True)
-            
-            # Botão de download Excel
-            buffer = BytesIO()
-            with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-                df_apenas_b.to_excel(writer, index=False, sheet_name='Apenas Produto B')
-            buffer.seek(0)
-            
-            st.download_button(
-                label="📥 Download Excel",
-                data=buffer,
-                file_name=f'clientes_apenas_B_{datetime.now().strftime("%Y%m%d")}.xlsx',
-                mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            )
-        else:
-            st.info("Nenhum cliente encontrado nesta categoria.")
-        
-        st.markdown("---")
-        
-        # Tabela: Compraram Ambos
-        st.markdown("### 🟣 Clientes que compraram AMBOS os produtos")
-        if len(resultado['ambos']) > 0:
-            # Get data for both products
-            df_prod_a = df_filtrado[
-                df_filtrado['cliente'].isin(resultado['ambos']) &
-                (df_filtrado['mercadoria'] == produto_a)
-            ].groupby('cliente').agg({
-                'descricao_produto': 'first'
-            }).reset_index().rename(columns={'descricao_produto': 'desc_a'})
-            
-            df_prod_b = df_filtrado[
-                df_filtrado['cliente'].isin(resultado['ambos']) &
-                (df_filtrado['mercadoria'] == produto_b)
-            ].groupby('cliente').agg({
-                'descricao_produto': 'first'
-            }).reset_index().rename(columns={'descricao_produto': 'desc_b'})
-            
-            df_ambos = df_filtrado[
-                df_filtrado['cliente'].isin(resultado['ambos'])
-            ].groupby('cliente').agg({
-                'raz_social': 'first',
-                'cidade': 'first',
-                'atividade': 'first',
-                'rede': 'first',
-                'vendedor': 'last',
-                'data_emissao': 'max',
-                'quant': 'sum'
-            }).reset_index()
-            
-            # Merge product descriptions
-            df_ambos = df_ambos.merge(df_prod_a, on='cliente', how='left')
-            df_ambos = df_ambos.merge(df_prod_b, on='cliente', how='left')
-            df_ambos['produtos'] = df_ambos['desc_a'] + ' | ' + df_ambos['desc_b']
-            df_ambos = df_ambos.drop(['desc_a', 'desc_b'], axis=1)
-            
-            df_ambos.columns = ['Cliente', 'Razão Social', 'Cidade', 'Atividade', 'Rede', 'Último Vendedor', 'Última Compra', 'Qtd Total', 'Produtos']
-            df_ambos = df_ambos.sort_values('Última Compra', ascending=False)
-            
-            st.dataframe(df_ambos, use_container_width=True)
-            
-            # Botão de download Excel
-            buffer = BytesIO()
-            with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-                df_ambos.to_excel(writer, index=False, sheet_name='Ambos Produtos')
-            buffer.seek(0)
-            
-            st.download_button(
-                label="📥 Download Excel",
-                data=buffer,
-                file_name=f'clientes_ambos_{datetime.now().strftime("%Y%m%d")}.xlsx',
-                mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            )
-        else:
-            st.info("Nenhum cliente encontrado nesta categoria.")
+        aba_tabelas(df_filtrado, resultado, produto_a, produto_b, selecao)
     
     # Rodapé
     st.markdown("---")
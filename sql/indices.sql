@@ -0,0 +1,10 @@
+-- Índices de apoio às consultas do VennV2.py
+-- Executar fora de transação: CREATE INDEX CONCURRENTLY não bloqueia escritas em vendas
+
+-- venn_counts: filtra por período e produto e agrupa por cliente
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_vendas_data_mercadoria_cliente
+    ON vendas (data_emissao, mercadoria, cliente);
+
+-- load_data também usa o índice acima: data_emissao é a coluna líder, então o
+-- intervalo sem cast vira Index Scan. Conferir com EXPLAIN (ANALYZE, BUFFERS)
+-- que o Seq Scan em vendas deixou de ocorrer.
@@ -0,0 +1,53 @@
+-- Views materializadas das listas de referência da sidebar do VennV2.py
+-- Cada view tem índice único para permitir REFRESH ... CONCURRENTLY
+
+-- Cidades de clientes com vendas
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_cidades AS
+SELECT DISTINCT c.cidade
+FROM vendas v
+inner join clientes c
+    on v.cliente = c.cliente
+WHERE c.cidade IS NOT null;
+
+CREATE UNIQUE INDEX IF NOT EXISTS mv_cidades_cidade
+    ON mv_cidades (cidade);
+
+-- Vendedores com vendas, inclusive os já desligados
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_vendedores AS
+SELECT DISTINCT v.vendedor
+FROM vendas v
+WHERE v.vendedor IS NOT null;
+
+CREATE UNIQUE INDEX IF NOT EXISTS mv_vendedores_vendedor
+    ON mv_vendedores (vendedor);
+
+-- Atividades de clientes com vendas
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_atividades AS
+SELECT DISTINCT c.atividade
+FROM vendas v
+inner join clientes c
+    on v.cliente = c.cliente
+WHERE c.atividade IS NOT null;
+
+CREATE UNIQUE INDEX IF NOT EXISTS mv_atividades_atividade
+    ON mv_atividades (atividade);
+
+-- Redes de clientes com vendas
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_redes AS
+SELECT DISTINCT c.rede
+FROM vendas v
+inner join clientes c
+    on v.cliente = c.cliente
+WHERE c.rede IS NOT null;
+
+CREATE UNIQUE INDEX IF NOT EXISTS mv_redes_rede
+    ON mv_redes (rede);
+
+-- Atualização periódica (a cada hora, alinhada ao ttl de fetch_reference_lists), via pg_cron:
+--
+-- SELECT cron.schedule('refresh_listas_venn', '0 * * * *', $$
+--     REFRESH MATERIALIZED VIEW CONCURRENTLY mv_cidades;
+--     REFRESH MATERIALIZED VIEW CONCURRENTLY mv_vendedores;
+--     REFRESH MATERIALIZED VIEW CONCURRENTLY mv_atividades;
+--     REFRESH MATERIALIZED VIEW CONCURRENTLY mv_redes;
+-- $$);